@@ -12,21 +12,37 @@ import itertools
 import logging
 from typing import TYPE_CHECKING, Literal
 
-import msgspec
+from msgspec.json import Decoder
 
 from .enums import ActionType
 from .http import HTTPClient
-from .types_ import GuildMemberPoints, GuildMemberRanking, GuildMemberScore, GuildRankings, StoreListing, User
+from .types_ import (
+    GuildMemberPoints,
+    GuildMemberRanking,
+    GuildMemberScore,
+    GuildRankings,
+    StoreListing,
+    User,
+)
 
 if TYPE_CHECKING:
     from types import TracebackType
 
+    import aiohttp
     from typing_extensions import Self
 
 __all__ = ("Client",)
 
 _LOGGER = logging.getLogger(__name__)
 
+# Decoders compile a type-specific decoding path on creation, so make them once and reuse them for every response.
+_GUILD_MEMBER_POINTS_DECODER = Decoder(GuildMemberPoints)
+_GUILD_MEMBER_SCORE_DECODER = Decoder(GuildMemberScore)
+_GUILD_MEMBER_RANKING_DECODER = Decoder(GuildMemberRanking)
+_GUILD_RANKINGS_DECODER = Decoder(GuildRankings)
+_USER_DECODER = Decoder(User)
+_STORE_LISTING_DECODER = Decoder(StoreListing)
+
 
 class Client:
     """The client that is used to handle interaction with the Tatsu API.
@@ -35,6 +51,11 @@ class Client:
     ----------
     token : :class:`str`
         The Tatsu API key that will be used to authorize all requests to it.
+    session : :class:`aiohttp.ClientSession`, optional
+        An existing session to send requests with. If not given, one is created when the first request is made.
+    connector : :class:`aiohttp.BaseConnector`, optional
+        A connector for the internally created session to share, e.g. between multiple clients. It isn't closed along
+        with this client. Can't be given along with `session`.
 
     Attributes
     ----------
@@ -42,8 +63,14 @@ class Client:
         The library's HTTP client for making requests to the Tatsu API. Initialized with the token.
     """
 
-    def __init__(self, token: str) -> None:
-        self.http = HTTPClient(token)
+    def __init__(
+        self,
+        token: str,
+        *,
+        session: aiohttp.ClientSession | None = None,
+        connector: aiohttp.BaseConnector | None = None,
+    ) -> None:
+        self.http = HTTPClient(token, session=session, connector=connector)
 
     async def __aenter__(self) -> Self:
         return self
@@ -55,6 +82,9 @@ class Client:
         """|coro|
 
         Close the internal HTTP session.
+
+        This is permanent: any request made afterwards raises :exc:`RuntimeError`, so create a new client instead of
+        reusing this one.
         """
 
         await self.http.close()
@@ -78,7 +108,7 @@ class Client:
         """
 
         data = await self.http.get_guild_member_points(guild_id, member_id)
-        return msgspec.json.decode(data, type=GuildMemberPoints)
+        return _GUILD_MEMBER_POINTS_DECODER.decode(data)
 
     async def update_member_points(self, guild_id: int, member_id: int, amount: int) -> GuildMemberPoints:
         """|coro|
@@ -102,7 +132,7 @@ class Client:
 
         action = ActionType.REMOVE if amount < 0 else ActionType.ADD
         data = await self.http.modify_guild_member_points(guild_id, member_id, action, abs(amount))
-        return msgspec.json.decode(data, type=GuildMemberPoints)
+        return _GUILD_MEMBER_POINTS_DECODER.decode(data)
 
     async def update_member_score(self, guild_id: int, member_id: int, amount: int) -> GuildMemberScore:
         """|coro|
@@ -125,8 +155,8 @@ class Client:
         """
 
         action = ActionType.REMOVE if amount < 0 else ActionType.ADD
-        data = await self.http.modify_guild_member_score(guild_id, member_id, action.value, abs(amount))
-        return msgspec.json.decode(data, type=GuildMemberScore)
+        data = await self.http.modify_guild_member_score(guild_id, member_id, action, abs(amount))
+        return _GUILD_MEMBER_SCORE_DECODER.decode(data)
 
     async def get_member_ranking(
         self,
@@ -154,7 +184,7 @@ class Client:
         """
 
         data = await self.http.get_guild_member_ranking(guild_id, member_id, period)
-        return msgspec.json.decode(data, type=GuildMemberRanking)
+        return _GUILD_MEMBER_RANKING_DECODER.decode(data)
 
     async def get_guild_rankings(
         self,
@@ -207,14 +237,14 @@ class Client:
         # Just perform one request.
         if end is None:
             data = await self.http.get_guild_rankings(guild_id, period, offset=start)
-            return msgspec.json.decode(data, type=GuildRankings)
+            return _GUILD_RANKINGS_DECODER.decode(data)
 
         end -= 1  # Tatsu API is 0-indexed.
 
         # Perform multiple requests if necessary and bring the rankings together in one object.
         coros = [self.http.get_guild_rankings(guild_id, period, offset=offset) for offset in range(start, end, 100)]
         results = await asyncio.gather(*coros)
-        rankings_list = [msgspec.json.decode(result, type=GuildRankings) for result in results]
+        rankings_list = [_GUILD_RANKINGS_DECODER.decode(result) for result in results]
         truncated_rankings = [
             ranking
             for ranking in itertools.chain(*[item.rankings for item in rankings_list])
@@ -237,7 +267,7 @@ class Client:
         """
 
         data = await self.http.get_user_profile(user_id)
-        return msgspec.json.decode(data, type=User)
+        return _USER_DECODER.decode(data)
 
     async def get_store_listing(self, listing_id: str) -> StoreListing:
         """Get information about a listing from the Tatsu store.
@@ -254,4 +284,4 @@ class Client:
         """
 
         data = await self.http.get_store_listing(listing_id)
-        return msgspec.json.decode(data, type=StoreListing)
+        return _STORE_LISTING_DECODER.decode(data)
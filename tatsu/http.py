@@ -8,22 +8,100 @@ The HTTP routes, requests, and response handlers for the Tatsu API.
 from __future__ import annotations
 
 import asyncio
+import itertools
 import logging
+import random
 import sys
-from collections.abc import Coroutine
-from datetime import datetime, timezone
-from typing import Any, ClassVar, Literal
-from urllib.parse import quote, urljoin
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Coroutine
+from email.utils import mktime_tz, parsedate_tz
+from string import Formatter
+from typing import Any, ClassVar, Literal, NoReturn
+from urllib.parse import quote
 
 import aiohttp
 import msgspec
 
 from . import __version__
 from .enums import ActionType
-from .errors import BadRequest, Forbidden, HTTPException, NotFound, TatsuServerError
+from .errors import BadRequest, Forbidden, HTTPException, NotFound, RateLimited, TatsuServerError
 
 _LOGGER = logging.getLogger(__name__)
 
+# The maximum number of GET responses kept around for conditional requests.
+_MAX_CACHED_RESPONSES = 512
+
+# Whether the running Python still leaks SSL transports that are aborted during shutdown.
+# Fixed upstream in 3.12.8 and 3.13.1, after which aiohttp warns if cleanup is requested.
+_NEEDS_CLEANUP_CLOSED = sys.version_info < (3, 12, 8) or (3, 13, 0) <= sys.version_info < (3, 13, 1)
+
+# The number of times a request is sent before giving up on ratelimits or temporary failures.
+_MAX_TRIES = 5
+
+# Server statuses that usually mean a temporary problem between Tatsu and its proxy, worth retrying.
+_RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+# Methods that can be sent again after the server may have already acted on them. Retrying anything else, like the
+# PATCH requests that modify points or score, could apply the same change twice.
+_IDEMPOTENT_METHODS = frozenset({"GET"})
+
+# The key for a cached GET response: the method, the URL, and the sorted query parameters.
+_CacheKey = tuple[str, str, tuple[Any, ...]]
+
+# A GET response kept for conditional requests: its ETag, its Last-Modified date, and its body.
+_CachedResponse = tuple[str | None, str | None, bytes]
+
+# A parsed path template: the literal text before, between, and after its fields.
+_RouteTemplate = tuple[str, ...]
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Get the number of seconds to wait from a ``Retry-After`` header, given as either seconds or an HTTP date."""
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def _backoff(tries: int) -> float:
+    """Get an exponentially increasing, jittered number of seconds to wait before retrying."""
+
+    return min(60, 2**tries) + random.uniform(0, 0.5)  # noqa: S311
+
+
+def _decode_error(data: bytes) -> str | dict[str, Any]:
+    """Decode the body of an error response, which might not be JSON if it came from a proxy in front of the API."""
+
+    try:
+        return msgspec.json.decode(data)
+    except msgspec.DecodeError:
+        return data.decode("utf-8", "replace")
+
+
+def _raise_for_status(response: aiohttp.ClientResponse, message: str | dict[str, Any]) -> NoReturn:
+    """Raise the exception matching an unsuccessful response's status."""
+
+    status = response.status
+    if status == 400:
+        raise BadRequest(response, message)
+    if status == 403:
+        raise Forbidden(response, message)
+    if status == 404:
+        raise NotFound(response, message)
+    if status == 429:
+        raise RateLimited(response, message)
+    if status >= 500:
+        raise TatsuServerError(response, message)
+    raise HTTPException(response, message)
+
 
 class Route:
     """A helper class for instantiating an HTTP method to Tatsu.
@@ -32,36 +110,109 @@ class Route:
     ----------
     method : :class:`str`
         The HTTP request to make, e.g. ``"GET"``.
-    path : :class:`str`
-        The prepended path to the API endpoint you want to hit, e.g. ``"/user/{user_id}/profile"``.
-    **parameters : Any
-        Special keyword arguments that will be substituted into the corresponding spot in the `path` where the key is
-        present, e.g. if your parameters are ``user_id=1234`` and your path is``"user/{user_id}/profile"``, the path
-        will become ``"user/1234/profile"``.
+    template : tuple[:class:`str`, ...]
+        The full URL of the API endpoint you want to hit, split around its fields: the literal text before, between,
+        and after them, starting with :attr:`BASE`. It always holds one more string than there are fields, e.g.
+        ``("https://api.tatsu.gg/v1/users/", "/profile")`` for the path ``"users/{user_id}/profile"``.
+    *segments : :class:`str`
+        Already stringified (and quoted, if necessary) values that will be substituted into the fields of the
+        `template` in order, e.g. if your segments are ``"1234"`` and your path is ``"users/{user_id}/profile"``, the
+        path will become ``"users/1234/profile"``.
+
+    Raises
+    ------
+    ValueError
+        The number of segments doesn't match the number of fields in the template.
     """
 
+    __slots__ = ("method", "template", "url")
+
     BASE: ClassVar[str] = "https://api.tatsu.gg/v1/"
 
-    def __init__(self, method: str, path: str, **parameters: Any) -> None:
+    def __init__(self, method: str, template: _RouteTemplate, *segments: str) -> None:
         self.method = method
-        self.path = path
-        url = urljoin(self.BASE, path)
-        if parameters:
-            url = url.format_map({k: quote(v) if isinstance(v, str) else v for k, v in parameters.items()})
-        self.url = url
+        self.template = template
+        self.url = "".join(itertools.chain.from_iterable(zip(template[:-1], segments, strict=True))) + template[-1]
+
+
+def _compile_path(path: str) -> _RouteTemplate:
+    """Parse a path like ``"users/{user_id}/profile"`` into a template for :class:`Route` ahead of time.
+
+    The base API URL is folded into the first literal, so building a URL is just joining strings.
+    """
+
+    literals = [Route.BASE]
+    for literal, field, _, _ in Formatter().parse(path):
+        literals[-1] += literal
+        if field is not None:
+            literals.append("")
+    return tuple(literals)
+
+
+_MEMBER_POINTS_TEMPLATE = _compile_path("guilds/{guild_id}/members/{member_id}/points")
+_MEMBER_SCORE_TEMPLATE = _compile_path("guilds/{guild_id}/members/{member_id}/score")
+_MEMBER_RANKING_TEMPLATE = _compile_path("guilds/{guild_id}/rankings/members/{user_id}/{time_range}")
+_GUILD_RANKINGS_TEMPLATE = _compile_path("guilds/{guild_id}/rankings/{time_range}")
+_USER_PROFILE_TEMPLATE = _compile_path("users/{user_id}/profile")
+_STORE_LISTING_TEMPLATE = _compile_path("store/listings/{listing_id}")
+
+
+class _ModifyAmount(msgspec.Struct, gc=False):
+    """The JSON body for modifying a guild member's points or score."""
+
+    action: ActionType
+    amount: int
+
+
+_JSON_ENCODER = msgspec.json.Encoder()
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class HTTPClient:
-    """A small HTTP client that sends requests to the Tatsu API."""
+    """A small HTTP client that sends requests to the Tatsu API.
+
+    Parameters
+    ----------
+    token : :class:`str`
+        The Tatsu API key that will be used to authorize all requests to it.
+    session : :class:`aiohttp.ClientSession`, optional
+        An existing session to send requests with. If not given, one is created when the first request is made.
+    connector : :class:`aiohttp.BaseConnector`, optional
+        A connector for the internally created session to share, e.g. between multiple clients. It isn't closed along
+        with this client. If not given, the session gets its own connector tuned to keep connections alive between
+        sparse requests. Can't be given along with `session`.
+
+    Raises
+    ------
+    ValueError
+        If both a session and a connector are given.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        *,
+        session: aiohttp.ClientSession | None = None,
+        connector: aiohttp.BaseConnector | None = None,
+    ) -> None:
+        if session is not None and connector is not None:
+            msg = "Only one of session and connector can be given."
+            raise ValueError(msg)
 
-    def __init__(self, token: str, *, session: aiohttp.ClientSession | None = None) -> None:
         self.token = token
         self._session = session
+        self._connector = connector
         user_agent = "Tatsu (https://github.com/Sachaa-Thanasius/Tatsu {0} Python/{1[0]}.{1[1]} aiohttp/{2}"
         self.user_agent = user_agent.format(__version__, sys.version_info, aiohttp.__version__)
-        self._ratelimit_unlock = asyncio.Event()
-        self._ratelimit_unlock.set()
-        self._ratelimit_reset_dt = None
+        self._headers = {"User-Agent": self.user_agent, "Authorization": self.token}
+        # Sessions made by this client send the headers above by default; ones passed in need them on every request.
+        self._owns_session = False
+        # Maps each route to the event loop time before which no further requests to it should be sent. The event loop
+        # is single-threaded and nothing awaits between reading and updating these, so they need no lock.
+        self._buckets: dict[_RouteTemplate, float] = {}
+        # Maps (method, url, query parameters) to responses for conditional GET requests, in LRU order.
+        self._cache: OrderedDict[_CacheKey, _CachedResponse] = OrderedDict()
+        self._closed = asyncio.Event()
 
     async def _start_session(self) -> None:
         """|coro|
@@ -69,18 +220,152 @@ class HTTPClient:
         Create an internal HTTP session for this client if necessary.
         """
 
+        # Closing this client is permanent, so a closed session here can only be one the user passed in and then closed
+        # themselves. Replace it with one of our own rather than failing every request.
         if (not self._session) or self._session.closed:
-            self._session = aiohttp.ClientSession()
+            if self._connector is not None:
+                self._session = aiohttp.ClientSession(
+                    connector=self._connector,
+                    connector_owner=False,
+                    headers=self._headers,
+                )
+            else:
+                connector = aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=20,
+                    keepalive_timeout=120,
+                    ttl_dns_cache=300,
+                    enable_cleanup_closed=_NEEDS_CLEANUP_CLOSED,
+                )
+                self._session = aiohttp.ClientSession(connector=connector, headers=self._headers)
+            self._owns_session = True
 
     async def close(self) -> None:
         """|coro|
 
-        Close the internal HTTP session.
+        Close the internal HTTP session. Requests waiting on a ratelimit or retry are woken up and fail.
+
+        This is permanent: any request made afterwards raises :exc:`RuntimeError`, so create a new client instead of
+        reusing this one.
         """
 
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        self._cache.clear()
+        self._buckets.clear()
         if self._session and not self._session.closed:
             await self._session.close()
 
+    async def _sleep(self, delay: float) -> None:
+        """|coro|
+
+        Wait for some number of seconds before retrying a request, unless the client is closed in the meantime.
+
+        Raises
+        ------
+        RuntimeError
+            If the client was closed while waiting.
+        """
+
+        try:
+            await asyncio.wait_for(self._closed.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            return
+
+        msg = "The HTTP client was closed while waiting to retry a request."
+        raise RuntimeError(msg)
+
+    async def _wait_for_bucket(self, route: Route, loop_time: Callable[[], float]) -> None:
+        """|coro|
+
+        Wait until the ratelimit bucket for a route allows another request to be sent.
+        """
+
+        while (delay := self._buckets.get(route.template, 0.0) - loop_time()) > 0:
+            # Check again after waking, since responses to other requests may have pushed the reset time back.
+            _LOGGER.debug("Waiting for %s seconds before sending %s %s.", delay, route.method, route.url)
+            await self._sleep(delay)
+
+    def _update_bucket(
+        self,
+        route: Route,
+        status: int,
+        headers_get: Callable[[str], str | None],
+        tries: int,
+        loop_time: Callable[[], float],
+    ) -> None:
+        """Push back the reset time of a route's ratelimit bucket based on a response's ratelimit headers."""
+
+        remaining = headers_get("X-RateLimit-Remaining")
+        reset = headers_get("X-RateLimit-Reset")
+        # The reset header is a Unix timestamp, so it needs the wall clock once to become a relative wait.
+        reset_after = (float(reset) - time.time()) if reset else None
+
+        if status == 429:
+            # Prefer what the server says to wait, and only guess when it says nothing useful, e.g. a reset time that
+            # has already passed.
+            wait = _parse_retry_after(headers_get("Retry-After"))
+            if wait is None:
+                wait = reset_after
+            if wait is None or wait <= 0:
+                wait = _backoff(tries)
+            _LOGGER.info("Hit a rate limit. Waiting for %s seconds for reset.", wait)
+        elif remaining == "0" and reset_after is not None:
+            wait = reset_after
+            _LOGGER.info("Emptied the ratelimit. Waiting for %s seconds for reset.", wait)
+        else:
+            return
+
+        reset_at = loop_time() + wait
+        if reset_at > self._buckets.get(route.template, 0.0):
+            self._buckets[route.template] = reset_at
+
+    def _prepare_conditional_get(
+        self,
+        route: Route,
+        kwargs: dict[str, Any],
+    ) -> tuple[_CacheKey | None, _CachedResponse | None]:
+        """Look up the cached response for a GET request and, if there is one, ask the server to revalidate it.
+
+        Returns the cache key, or None if the request can't be cached, along with the cached response, if any.
+        """
+
+        if route.method != "GET":
+            return None, None
+
+        cache_key: _CacheKey = (route.method, route.url, tuple(sorted(kwargs.get("params", {}).items())))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            etag, last_modified, _ = cached
+            headers = kwargs["headers"] = {**kwargs.get("headers", {})}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return cache_key, cached
+
+    def _store_cached(
+        self,
+        cache_key: _CacheKey | None,
+        headers_get: Callable[[str], str | None],
+        data: bytes,
+    ) -> None:
+        """Keep a successful GET response for later conditional requests if the server gave a way to revalidate it."""
+
+        if cache_key is None:
+            return
+
+        etag = headers_get("ETag")
+        last_modified = headers_get("Last-Modified")
+        if etag or last_modified:
+            self._cache[cache_key] = (etag, last_modified, data)
+            self._cache.move_to_end(cache_key)
+            if len(self._cache) > _MAX_CACHED_RESPONSES:
+                self._cache.popitem(last=False)
+
     async def request(self, route: Route, **kwargs: Any) -> bytes:
         """|coro|
 
@@ -94,85 +379,89 @@ class HTTPClient:
             Arbitrary keyword arguments for :meth:`aiohttp.ClientSession.request`. See that method for more information.
         """
 
+        if self._closed.is_set():
+            msg = "The HTTP client is closed."
+            raise RuntimeError(msg)
+
         method = route.method
         url = route.url
 
-        headers = kwargs.pop("headers", {})
-        headers["User-Agent"] = self.user_agent
-        headers["Authorization"] = self.token
-        kwargs["headers"] = headers
-
         await self._start_session()
 
-        if not self._ratelimit_unlock.is_set():
-            await self._ratelimit_unlock.wait()
+        if not self._owns_session:
+            kwargs["headers"] = {**self._headers, **kwargs.get("headers", {})}
+
+        # Revalidate previously seen GET responses instead of downloading them again.
+        cache_key, cached = self._prepare_conditional_get(route, kwargs)
+
+        # Bind what the retry loop uses repeatedly to locals.
+        session_request = self._session.request
+        idempotent = method in _IDEMPOTENT_METHODS
+        loop_time = asyncio.get_running_loop().time
+
+        # Avoid formatting the URL and reading headers just for log records that would be dropped.
+        debug_enabled = _LOGGER.isEnabledFor(logging.DEBUG)
 
         response: aiohttp.ClientResponse | None = None
-        for _tries in range(5):
-            async with self._session.request(method, url, **kwargs) as response:
-                _LOGGER.debug("%s %s has returned %d.", method, response.url.human_repr(), response.status)
-
-                data = await response.read()
-                _LOGGER.debug(data)
-
-                limit = response.headers.get("X-RateLimit-Limit")
-                remaining = response.headers.get("X-RateLimit-Remaining")
-                reset = response.headers.get("X-RateLimit-Reset")
-                reset_dt = datetime.fromtimestamp(float(reset), tz=timezone.utc).astimezone()
-
-                msg = "Rate limit info: limit=%s, remaining=%s, reset=%s (tries=%s)"
-                _LOGGER.debug(msg, limit, remaining, reset_dt, _tries)
-
-                if not self._ratelimit_reset_dt or self._ratelimit_reset_dt < reset_dt:
-                    self._ratelimit_reset_dt = reset_dt
-
-                if response.status != 429 and remaining == "0":
-                    now = datetime.now(tz=timezone.utc).astimezone()
-                    self._ratelimit_unlock.clear()
-                    wait_delta = self._ratelimit_reset_dt - now
-                    _LOGGER.info("Emptied the ratelimit. Waiting for %s seconds for reset.", wait_delta.total_seconds())
-                    await asyncio.sleep(wait_delta.total_seconds())
-                    self._ratelimit_unlock.set()
-
-                if 300 > response.status >= 200:
-                    return data
-
-                message = msgspec.json.decode(data)
-
-                if response.status == 429:
-                    now = datetime.now(tz=timezone.utc).astimezone()
-                    self._ratelimit_unlock.clear()
-                    _LOGGER.debug(
-                        "Comparison of timestamps (now vs. ratelimit reset time): %s vs %s",
-                        now,
-                        self._ratelimit_reset_dt,
-                    )
-                    wait_delta = self._ratelimit_reset_dt - now
-                    _LOGGER.info("Hit a rate limit. Waiting for %s seconds for reset.", wait_delta.total_seconds())
-                    await asyncio.sleep(wait_delta.total_seconds())
-                    self._ratelimit_unlock.set()
-                    continue
-
-                if response.status == 400:
-                    raise BadRequest(response, message)
-                if response.status == 403:
-                    raise Forbidden(response, message)
-                if response.status == 404:
-                    raise NotFound(response, message)
-                if response.status >= 500:
-                    raise TatsuServerError(response, message)
-
-                raise HTTPException(response, message)
-
-        if response is not None:
-            _LOGGER.debug("Reached maximum number of retries.")
-            raise HTTPException(response, message)
-
-        msg = "Unreachable code in HTTP handling."
-        raise RuntimeError(msg)
+        message: str | dict[str, Any] | None = None
+        for _tries in range(_MAX_TRIES):
+            # Wait out the ratelimit learned from earlier responses rather than spending a request to discover it.
+            await self._wait_for_bucket(route, loop_time)
+
+            try:
+                async with session_request(method, url, **kwargs) as response:
+                    status = response.status
+                    headers_get = response.headers.get
+                    data = await response.read()
+                    if debug_enabled:
+                        _LOGGER.debug("%s %s has returned %d.", method, response.url.human_repr(), status)
+                        _LOGGER.debug(data)
+                        _LOGGER.debug(
+                            "Rate limit info: limit=%s, remaining=%s, reset=%s (tries=%s)",
+                            headers_get("X-RateLimit-Limit"),
+                            headers_get("X-RateLimit-Remaining"),
+                            headers_get("X-RateLimit-Reset"),
+                            _tries,
+                        )
+
+                    self._update_bucket(route, status, headers_get, _tries, loop_time)
+
+                    if status == 304 and cached is not None:
+                        return cached[2]
+
+                    if 300 > status >= 200:
+                        self._store_cached(cache_key, headers_get, data)
+                        return data
+
+                    message = _decode_error(data)
+
+                    if status == 429:
+                        # The bucket now holds the server's reset time, so the next try waits for it before sending.
+                        continue
+
+                    # Only requests that are safe to repeat are retried on temporary server errors.
+                    if not (idempotent and status in _RETRYABLE_STATUSES):
+                        _raise_for_status(response, message)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                # A connector error means the request was never sent, so it's safe to send again. Otherwise, the
+                # server may have already received it.
+                sent = not isinstance(exc, aiohttp.ClientConnectorError)
+                if (sent and not idempotent) or _tries == _MAX_TRIES - 1:
+                    raise
+                _LOGGER.warning("%s %s failed with %r. Retrying.", method, url, exc)
+
+            # The server or connection had a temporary problem, so back off before trying again.
+            if _tries < _MAX_TRIES - 1:
+                await self._sleep(_backoff(_tries))
+
+        # Only reachable if every try was ratelimited or hit a temporary server error.
+        assert response is not None
+        assert message is not None
+        _LOGGER.debug("Reached maximum number of retries.")
+        _raise_for_status(response, message)
 
     def get_guild_member_points(self, guild_id: int, member_id: int) -> Coroutine[Any, Any, bytes]:
-        route = Route("GET", "guilds/{guild_id}/members/{member_id}/points", guild_id=guild_id, member_id=member_id)
+        route = Route("GET", _MEMBER_POINTS_TEMPLATE, str(guild_id), str(member_id))
         return self.request(route)
 
     def modify_guild_member_points(
@@ -186,24 +475,24 @@ class HTTPClient:
             msg = "Points amount must be between 1 and 100,000."
             raise ValueError(msg)
 
-        route = Route("PATCH", "guilds/{guild_id}/members/{member_id}/points", guild_id=guild_id, member_id=member_id)
-        data = msgspec.json.encode({"action": action, "amount": amount})
-        return self.request(route, data=data)
+        route = Route("PATCH", _MEMBER_POINTS_TEMPLATE, str(guild_id), str(member_id))
+        data = _JSON_ENCODER.encode(_ModifyAmount(action, amount))
+        return self.request(route, data=data, headers=_JSON_HEADERS)
 
     def modify_guild_member_score(
         self,
         guild_id: int,
         member_id: int,
-        action: int,
+        action: ActionType,
         amount: int,
     ) -> Coroutine[Any, Any, bytes]:
         if amount < 1 or amount > 100_000:
             msg = "Score amount must be between 1 and 100,000."
             raise ValueError(msg)
 
-        route = Route("PATCH", "guilds/{guild_id}/members/{member_id}/score", guild_id=guild_id, member_id=member_id)
-        data = msgspec.json.encode({"action": action, "amount": amount})
-        return self.request(route, data=data)
+        route = Route("PATCH", _MEMBER_SCORE_TEMPLATE, str(guild_id), str(member_id))
+        data = _JSON_ENCODER.encode(_ModifyAmount(action, amount))
+        return self.request(route, data=data, headers=_JSON_HEADERS)
 
     def get_guild_member_ranking(
         self,
@@ -211,13 +500,7 @@ class HTTPClient:
         user_id: int,
         period: Literal["all", "month", "week"] = "all",
     ) -> Coroutine[Any, Any, bytes]:
-        route = Route(
-            "GET",
-            "guilds/{guild_id}/rankings/members/{user_id}/{time_range}",
-            guild_id=guild_id,
-            user_id=user_id,
-            time_range=period,
-        )
+        route = Route("GET", _MEMBER_RANKING_TEMPLATE, str(guild_id), str(user_id), period)
         return self.request(route)
 
     def get_guild_rankings(
@@ -231,14 +514,14 @@ class HTTPClient:
             msg = "Pagination offset must be greater than or equal to 0."
             raise ValueError(msg)
 
-        route = Route("GET", "guilds/{guild_id}/rankings/{time_range}", guild_id=guild_id, time_range=period)
+        route = Route("GET", _GUILD_RANKINGS_TEMPLATE, str(guild_id), period)
         params = {"offset": offset}
         return self.request(route, params=params)
 
     def get_user_profile(self, user_id: int) -> Coroutine[Any, Any, bytes]:
-        route = Route("GET", "users/{user_id}/profile", user_id=user_id)
+        route = Route("GET", _USER_PROFILE_TEMPLATE, str(user_id))
         return self.request(route)
 
     def get_store_listing(self, listing_id: str) -> Coroutine[Any, Any, bytes]:
-        route = Route("GET", "store/listings/{listing_id}", listing_id=listing_id)
+        route = Route("GET", _STORE_LISTING_TEMPLATE, quote(listing_id))
         return self.request(route)
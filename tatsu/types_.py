@@ -23,7 +23,7 @@ __all__ = (
 )
 
 
-class GuildMemberPoints(Struct):
+class GuildMemberPoints(Struct, frozen=True, gc=False):
     """A Discord guild member's points information.
 
     Parameters
@@ -44,7 +44,7 @@ class GuildMemberPoints(Struct):
     user_id: str
 
 
-class GuildMemberScore(Struct):
+class GuildMemberScore(Struct, frozen=True, gc=False):
     """A Discord guild member's score information.
 
     Parameters
@@ -62,7 +62,7 @@ class GuildMemberScore(Struct):
     user_id: str
 
 
-class GuildMemberRanking(Struct):
+class GuildMemberRanking(Struct, frozen=True, gc=False):
     """A Discord guild member's ranking information over some period of time.
 
     Attributes
@@ -83,7 +83,7 @@ class GuildMemberRanking(Struct):
     user_id: str
 
 
-class Ranking(Struct):
+class Ranking(Struct, frozen=True, gc=False):
     """A generic rank information object.
 
     Attributes
@@ -101,7 +101,7 @@ class Ranking(Struct):
     user_id: str
 
 
-class GuildRankings(Struct):
+class GuildRankings(Struct, frozen=True, gc=False):
     """All the rankings in a guild over some period of time.
 
     Attributes
@@ -116,7 +116,7 @@ class GuildRankings(Struct):
     rankings: list[Ranking] = []
 
 
-class User(Struct):
+class User(Struct, frozen=True, gc=False):
     """A Tatsu-bot user.
 
     Attributes
@@ -164,7 +164,7 @@ class User(Struct):
     subscription_renewal: datetime.datetime | None = None
 
 
-class StorePrice(Struct):
+class StorePrice(Struct, frozen=True, gc=False):
     """A price of a Tatsu store item.
 
     Attributes
@@ -179,7 +179,7 @@ class StorePrice(Struct):
     amount: float
 
 
-class StoreListing(Struct):
+class StoreListing(Struct, frozen=True, gc=False):
     """The listing of a Tatsu store item.
 
     Attributes